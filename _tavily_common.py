@@ -0,0 +1,194 @@
+"""
+Shared helpers for the Tavily search Lambda functions
+lambda_simple_tavily.py / lambda_enhanced_tavily.py の共通処理
+"""
+import json
+from typing import Dict, Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+# tavily はコールドスタート短縮のため初回の get_client まで読み込まない
+TavilyClient = None
+
+# スニペット省略記号（U+2026、1文字で省略を表す）
+_ELLIPSIS = "…"
+
+# Tavilyクライアント（Lambda コンテナ再利用時に接続を使い回す）
+_TAVILY_CLIENT = None
+_TAVILY_CLIENT_KEY = None
+
+
+def dumps(obj: Any) -> str:
+    """
+    JSON文字列化（orjson があれば使用、空白なしのコンパクト形式）
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def dumpb_sorted(obj: Any) -> bytes:
+    """
+    キー順を固定したJSONバイト列（キャッシュキー用の正規化表現）
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'),
+                      default=str, sort_keys=True).encode()
+
+
+class LazyJson:
+    """
+    ログ出力時にだけJSON化するラッパー（ログレベルで抑制された場合は json.dumps を実行しない）
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj: Any):
+        self.obj = obj
+
+    def __str__(self) -> str:
+        return dumps(self.obj)
+
+
+def get_client(api_key: str) -> Any:
+    """
+    TavilyClientを取得（ウォーム起動時は前回のインスタンスを再利用）
+    """
+    global TavilyClient, _TAVILY_CLIENT, _TAVILY_CLIENT_KEY
+    if TavilyClient is None:
+        # 未インストールの場合は ImportError がそのまま呼び出し元へ伝わる
+        from tavily import TavilyClient as client_cls
+        TavilyClient = client_cls
+    if _TAVILY_CLIENT is None or _TAVILY_CLIENT_KEY != api_key:
+        _TAVILY_CLIENT = TavilyClient(api_key=api_key)
+        _TAVILY_CLIENT_KEY = api_key
+    return _TAVILY_CLIENT
+
+
+def extract_query_parameter(event: Dict[str, Any]) -> Optional[str]:
+    """
+    イベントからクエリパラメータを抽出
+    """
+    # Bedrock Agent の標準形式: parameters[0].value
+    parameters = event.get('parameters')
+    if parameters and isinstance(parameters, list):
+        first = parameters[0]
+        value = first.get('value') if isinstance(first, dict) else None
+        if value:
+            return str(value)
+
+    # トップレベルのキー
+    for key in ('inputText', 'query', 'message'):
+        value = event.get(key)
+        if value:
+            return str(value)
+
+    return None
+
+
+def format_results(raw_results: Dict[str, Any], snippet_limit: int,
+                   include_metadata: bool = False) -> Dict[str, Any]:
+    """
+    Tavily検索結果を整形
+    snippet_limit: スニペットの最大文字数
+    include_metadata: published_date / author を含めるか
+    """
+    results = raw_results.get('results', [])
+    sources = [None] * len(results)
+
+    for idx, result in enumerate(results):
+        url = result.get('url', '')
+        title = result.get('title', '')
+        content = result.get('content', '')
+
+        # コンテンツを適切な長さに調整（省略記号を含めて snippet_limit 文字以内）
+        if len(content) > snippet_limit:
+            content = f"{content[:snippet_limit - 1]}{_ELLIPSIS}"
+
+        source_item = {
+            "id": f"source_{idx + 1}",
+            "url": url,
+            "title": title,
+            "snippet": content,
+            "relevance_score": result.get('score', 0.5)
+        }
+
+        # 追加情報（値がある場合のみ）
+        if include_metadata:
+            published_date = result.get('published_date')
+            if published_date:
+                source_item["published_date"] = published_date
+            author = result.get('author')
+            if author:
+                source_item["author"] = author
+
+        sources[idx] = source_item
+
+    # URL一覧は sources から一括で生成
+    urls = [s["url"] for s in sources if s["url"]]
+
+    return {
+        "summary": raw_results.get('answer', ''),
+        "sources": sources,
+        "urls": urls,
+        "total_results": len(sources)
+    }
+
+
+def create_fallback_response(query: str) -> Dict[str, Any]:
+    """
+    エラー時のフォールバックレスポンス
+    """
+    return {
+        "summary": "検索結果を取得できませんでした。",
+        "sources": [],
+        "urls": [],
+        "total_results": 0
+    }
+
+
+def create_response(event: Dict[str, Any], body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    API Gateway用のレスポンスを作成
+    """
+    # 単一の式で組み立て、中間変数を作らずに返す
+    return {
+        "messageVersion": "1.0",
+        "response": {
+            "actionGroup": event.get("actionGroup", "WebSearchGroup"),
+            "function": event.get("function", "tavily_search"),
+            "functionResponse": {
+                "responseBody": {
+                    "TEXT": {
+                        "body": dumps(body)
+                    }
+                }
+            }
+        }
+    }
+
+
+def create_error_response(event: Dict[str, Any], error_message: str,
+                          params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    エラーレスポンスを作成
+    params は呼び出し元で抽出済みのものを受け取る（未抽出の場合はクエリを空にする）
+    """
+    error_body = {
+        "type": "search_results",
+        "query": (params or {}).get('query', ''),
+        "search_performed": False,
+        "error": error_message,
+        "summary": f"エラーが発生しました: {error_message}",
+        "sources": [],
+        "urls": [],
+        "total_results": 0
+    }
+
+    return create_response(event, error_body)
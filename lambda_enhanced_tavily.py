@@ -3,25 +3,62 @@ Enhanced Lambda function for Tavily search with full parameter support
 Optimized for flexible search with all Tavily features
 """
 import os
-import json
+import re
 import logging
 import time
 import hashlib
-from typing import Dict, Any, Optional, List
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+
+from _tavily_common import (
+    HAS_ORJSON,
+    LazyJson,
+    create_error_response,
+    create_fallback_response,
+    create_response,
+    dumpb_sorted,
+    extract_query_parameter,
+    format_results,
+    get_client,
+)
 
 # ログ設定
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # グローバルキャッシュ（Lambda コンテナ再利用時に有効）
-SEARCH_CACHE = {}
+# LRU + TTL で上限を設ける（ウォームコンテナでのメモリ肥大を防止）
+SEARCH_CACHE: "OrderedDict[bytes, tuple]" = OrderedDict()
 CACHE_TTL = 300  # 5分間キャッシュ
+NEGATIVE_CACHE_TTL = 30  # 検索失敗時のフォールバックは30秒だけキャッシュ
+CACHE_MAX_ENTRIES = 256
+CACHE_SWEEP_BATCH = 16  # 1回の掃除で確認する古いエントリ数
+# キャッシュキーに含めるパラメータ（days は時間バケットと組み合わせて別途扱う）
+CACHE_KEY_FIELDS = ('query', 'search_depth', 'topic', 'max_results',
+                    'include_domains', 'exclude_domains', 'include_answer',
+                    'include_raw_content', 'include_images')
+CACHE_DAYS_BUCKET = 3600  # days 指定時は1時間単位でキーを分ける
+INFLIGHT_WAIT_TIMEOUT = 30  # 同一キーの検索完了を待つ最大秒数
+
+# 同一コンテナ内の並行呼び出しで同じ検索を重複実行しないための管理（single-flight）
+_CACHE_LOCK = threading.Lock()
+_INFLIGHT: Dict[bytes, "InflightSearch"] = {}
+
+# 軽量検索に切り替えるキーワード（オッズ、価格、数値情報）
+_LIGHT_KEYWORDS = ('odds', 'price', 'rate', 'オッズ', '価格', '倍率')
+_LIGHT_RE = re.compile('|'.join(map(re.escape, _LIGHT_KEYWORDS)))
+
+# 真とみなす文字列表現（Bedrock からは文字列・ネイティブ bool のどちらも来る）
+_TRUE = frozenset(('true', '1', 'yes', 't', 'y'))
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     強化版Tavily検索Lambda関数
     複数パラメータに対応し、Tavilyの全機能を活用
     """
+    params = None
     try:
         start_time = time.time()
         
@@ -37,16 +74,17 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # クエリの存在確認
         query = params.get('query')
         if not query:
-            return create_error_response(event, "Query parameter required")
+            return create_error_response(event, "Query parameter required", params)
         
-        logger.info(f"Processing query: {query} with params: {json.dumps(params, ensure_ascii=False)}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Processing query: %s with params: %s", query, LazyJson(params))
         
         # Tavily検索を実行（全パラメータ使用）
         search_results = perform_enhanced_tavily_search(tavily_api_key, params)
         
         # 処理時間を記録
         processing_time = time.time() - start_time
-        logger.info(f"Search completed in {processing_time:.2f} seconds")
+        logger.info("Search completed in %.2f seconds", processing_time)
         
         # 最適化されたレスポンスを返す
         return create_response(event, {
@@ -58,8 +96,8 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         })
         
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-        return create_error_response(event, str(e))
+        logger.error("Unexpected error: %s", e, exc_info=True)
+        return create_error_response(event, str(e), params)
 
 
 def extract_all_parameters(event: Dict[str, Any]) -> Dict[str, Any]:
@@ -95,224 +133,292 @@ def extract_all_parameters(event: Dict[str, Any]) -> Dict[str, Any]:
     return params
 
 
-def extract_query_parameter(event: Dict[str, Any]) -> Optional[str]:
+def _tobool(value: Any, default: bool) -> bool:
     """
-    従来の互換性のためのクエリ抽出（フォールバック用）
+    パラメータ値を bool に変換（未指定時は default）
     """
-    paths = [
-        ['parameters', 0, 'value'],
-        ['inputText'],
-        ['query'],
-        ['message']
-    ]
-    
-    for path in paths:
-        try:
-            value = event
-            for key in path:
-                if isinstance(key, int):
-                    value = value[key]
-                else:
-                    value = value.get(key)
-                if value is None:
-                    break
-            if value:
-                return str(value)
-        except (KeyError, IndexError, TypeError):
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return default
+    return str(value).lower() in _TRUE
+
+
+def _split_domains(domains: Any) -> Any:
+    """
+    カンマ区切りのドメイン文字列をリストに変換（リスト指定はそのまま）
+    """
+    if isinstance(domains, str):
+        return [d for d in map(str.strip, domains.split(',')) if d]
+    return domains
+
+
+def canonicalize_cache_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    キャッシュに影響するパラメータだけを取り出し、順序に依存しない形に正規化
+    """
+    canonical = {}
+    for key in CACHE_KEY_FIELDS:
+        value = params.get(key)
+        if value is None:
             continue
+        if key in ('include_domains', 'exclude_domains'):
+            # ドメインの並び順が違っても同じキーになるようソート
+            value = sorted(_split_domains(value))
+        canonical[key] = value
     
-    return None
+    # days は相対指定なので時間バケットと組み合わせる
+    days_value = params.get('days')
+    if days_value and str(days_value) != '0':
+        canonical['days'] = (str(days_value), int(time.time()) // CACHE_DAYS_BUCKET)
+    
+    return canonical
+
+
+def build_cache_key(params: Dict[str, Any]) -> bytes:
+    """
+    パラメータからキャッシュキーを生成
+    orjson があればキー順固定のバイト列を一括でハッシュし、
+    なければ json.dumps を経由せず直接ハッシュに流し込む
+    """
+    # セキュリティ用途ではないため高速な BLAKE2b(128bit) を使用
+    if HAS_ORJSON:
+        return hashlib.blake2b(dumpb_sorted(params), digest_size=16).digest()
+    
+    h = hashlib.blake2b(digest_size=16)
+    for key in sorted(params):
+        value = params[key]
+        # str/数値/bool 以外（リスト等）は str() で正規化
+        if not isinstance(value, (str, int, float, bool)):
+            value = str(value)
+        h.update(key.encode())
+        h.update(b'\x1f')
+        h.update(repr(value).encode())
+        h.update(b'\x1e')
+    return h.digest()
+
+
+def get_cached_result(cache_key: bytes) -> Optional[Dict[str, Any]]:
+    """
+    キャッシュから有効な結果を取得（ヒット時はLRU順を更新、期限切れは削除）
+    ヒット時もLRU順を書き換えるため、読み取りも _CACHE_LOCK 内で行う
+    """
+    with _CACHE_LOCK:
+        entry = SEARCH_CACHE.get(cache_key)
+        if entry is None:
+            return None
+
+        cached_result, cached_time, ttl = entry
+        if time.time() - cached_time >= ttl:
+            del SEARCH_CACHE[cache_key]
+            return None
+
+        SEARCH_CACHE.move_to_end(cache_key)
+        return cached_result
+
+
+def store_cached_result(cache_key: bytes, result: Dict[str, Any],
+                        ttl: float = CACHE_TTL) -> None:
+    """
+    結果をキャッシュに保存し、TTL切れ・上限超過のエントリを追い出す
+    ttl: エントリごとの有効期間（失敗時のネガティブキャッシュは短くする）
+    """
+    with _CACHE_LOCK:
+        now = time.time()
+        SEARCH_CACHE[cache_key] = (result, now, ttl)
+        SEARCH_CACHE.move_to_end(cache_key)
+
+        # 一定量を超えたら古い側から期限切れエントリを少しずつ掃除
+        if len(SEARCH_CACHE) > CACHE_MAX_ENTRIES // 2:
+            expired = [
+                key for key, (_, cached_time, entry_ttl) in
+                itertools.islice(SEARCH_CACHE.items(), CACHE_SWEEP_BATCH)
+                if now - cached_time >= entry_ttl
+            ]
+            for key in expired:
+                SEARCH_CACHE.pop(key, None)
+
+        # 上限を超えた分は最も古いものから削除
+        while len(SEARCH_CACHE) > CACHE_MAX_ENTRIES:
+            SEARCH_CACHE.popitem(last=False)
+
+
+class InflightSearch:
+    """
+    実行中の検索（完了通知と、キャッシュされない結果の受け渡しに使う）
+    """
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
+
+def claim_inflight(cache_key: bytes) -> Tuple[InflightSearch, bool]:
+    """
+    同一キーの検索実行権を取得
+    戻り値の bool が True なら自分が実行する（完了後に release_inflight を呼ぶこと）
+    False なら他の呼び出しが実行中なので、その InflightSearch の完了を待つ
+    """
+    with _CACHE_LOCK:
+        inflight = _INFLIGHT.get(cache_key)
+        if inflight is None:
+            inflight = _INFLIGHT[cache_key] = InflightSearch()
+            return inflight, True
+        return inflight, False
+
+
+def release_inflight(cache_key: bytes, inflight: InflightSearch) -> None:
+    """
+    検索実行権を解放し、待機中の呼び出しを再開させる
+    """
+    with _CACHE_LOCK:
+        _INFLIGHT.pop(cache_key, None)
+    inflight.event.set()
 
 
 def perform_enhanced_tavily_search(api_key: str, params: Dict[str, Any]) -> Dict[str, Any]:
     """
     強化版Tavily API検索（全パラメータ活用 + キャッシュ）
     """
-    try:
-        # キャッシュキーの生成
-        cache_key = hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()
-        
+    # キャッシュキーの生成
+    cache_key = build_cache_key(canonicalize_cache_params(params))
+    
+    while True:
         # キャッシュチェック
-        if cache_key in SEARCH_CACHE:
-            cached_result, cached_time = SEARCH_CACHE[cache_key]
-            if time.time() - cached_time < CACHE_TTL:
-                logger.info(f"Cache hit for query: {params.get('query')}")
-                cached_result['from_cache'] = True
-                return cached_result
-        
-        from tavily import TavilyClient
-        client = TavilyClient(api_key=api_key)
-        
-        query_lower = params.get('query', '').lower()
-        
-        # クエリタイプに基づく自動最適化
-        # オッズ、価格、数値情報は軽量検索で十分
-        if any(keyword in query_lower for keyword in ['odds', 'price', 'rate', 'オッズ', '価格', '倍率']):
-            search_depth = 'basic'
-            max_results = 3
-        else:
-            search_depth = params.get('search_depth', 'advanced')
-            max_results = int(params.get('max_results', 5))
-        
-        # 検索パラメータの構築
-        search_params = {
-            "query": params.get('query'),
-            "search_depth": search_depth,
-            "max_results": max_results
-        }
-        
-        # オプションパラメータの追加
-        if 'topic' in params:
-            search_params['topic'] = params['topic']
-        
-        if 'days' in params:
-            days_value = params.get('days')
-            if days_value and str(days_value) != '0':
-                search_params['days'] = int(days_value)
+        cached_result = get_cached_result(cache_key)
+        if cached_result is not None:
+            logger.info("Cache hit for query: %s", params.get('query'))
+            cached_result['from_cache'] = True
+            return cached_result
         
-        # ブール値パラメータの処理
-        search_params['include_answer'] = str(params.get('include_answer', 'true')).lower() == 'true'
-        search_params['include_raw_content'] = str(params.get('include_raw_content', 'false')).lower() == 'true'
-        search_params['include_images'] = str(params.get('include_images', 'false')).lower() == 'true'
+        inflight, owner = claim_inflight(cache_key)
+        if owner:
+            break
         
-        # ドメインフィルタの処理
-        if 'include_domains' in params and params['include_domains']:
-            domains = params['include_domains']
-            if isinstance(domains, str):
-                domains = [d.strip() for d in domains.split(',') if d.strip()]
-            search_params['include_domains'] = domains
+        # 同じ検索が実行中なら完了を待ち、その結果を受け取る
+        # （0件などキャッシュされない結果もここで共有する）
+        inflight.event.wait(timeout=INFLIGHT_WAIT_TIMEOUT)
+        if inflight.result is not None:
+            logger.info("Shared in-flight result for query: %s", params.get('query'))
+            return {**inflight.result, 'from_cache': True}
+        # タイムアウトした場合はキャッシュ確認からやり直す
+    
+    try:
+        inflight.result = execute_enhanced_tavily_search(api_key, params, cache_key)
+        return inflight.result
+    finally:
+        release_inflight(cache_key, inflight)
+
+
+def build_search_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    抽出済みパラメータから client.search に渡す検索パラメータを構築
+    """
+    query_lower = params.get('query', '').lower()
+    
+    # クエリタイプに基づく自動最適化
+    # オッズ、価格、数値情報は軽量検索で十分
+    if _LIGHT_RE.search(query_lower) is not None:
+        search_depth = 'basic'
+        max_results = 3
+    else:
+        search_depth = params.get('search_depth', 'advanced')
+        max_results = int(params.get('max_results', 5))
+    
+    # 検索パラメータの構築
+    search_params = {
+        "query": params.get('query'),
+        "search_depth": search_depth,
+        "max_results": max_results
+    }
+    
+    # オプションパラメータの追加
+    if 'topic' in params:
+        search_params['topic'] = params['topic']
+    
+    if 'days' in params:
+        days_value = params.get('days')
+        if days_value and str(days_value) != '0':
+            search_params['days'] = int(days_value)
+    
+    # ブール値パラメータの処理
+    search_params['include_answer'] = _tobool(params.get('include_answer'), True)
+    search_params['include_raw_content'] = _tobool(params.get('include_raw_content'), False)
+    search_params['include_images'] = _tobool(params.get('include_images'), False)
+    
+    # ドメインフィルタの処理
+    if params.get('include_domains'):
+        search_params['include_domains'] = _split_domains(params['include_domains'])
+    
+    if params.get('exclude_domains'):
+        search_params['exclude_domains'] = _split_domains(params['exclude_domains'])
+    
+    return search_params
+
+
+def execute_enhanced_tavily_search(api_key: str, params: Dict[str, Any],
+                                   cache_key: bytes) -> Dict[str, Any]:
+    """
+    Tavily APIを呼び出して結果を整形・キャッシュ（キャッシュ確認と重複排除は呼び出し元で実施）
+    ネガティブキャッシュするのは tavily の読み込み失敗と API 呼び出しの失敗のみ
+    """
+    query = params.get('query')
+    try:
+        try:
+            client = get_client(api_key)
+        except ImportError:
+            logger.error("Tavily module not found")
+            return create_cached_fallback(cache_key, query)
         
-        if 'exclude_domains' in params and params['exclude_domains']:
-            domains = params['exclude_domains']
-            if isinstance(domains, str):
-                domains = [d.strip() for d in domains.split(',') if d.strip()]
-            search_params['exclude_domains'] = domains
+        search_params = build_search_params(params)
         
-        logger.info(f"Calling Tavily API with params: {json.dumps(search_params, ensure_ascii=False)}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Calling Tavily API with params: %s", LazyJson(search_params))
         
         # 検索実行
-        raw_results = client.search(**search_params)
+        try:
+            raw_results = client.search(**search_params)
+        except Exception as e:
+            logger.error("Search error: %s", e)
+            return create_cached_fallback(cache_key, query)
         
-        logger.info(f"Tavily returned {len(raw_results.get('results', []))} results")
+        logger.info("Tavily returned %d results", len(raw_results.get('results', [])))
         
         # 結果の整形（AI要約を含む）
-        result = format_enhanced_search_results(raw_results, params.get('query'))
+        result = format_enhanced_search_results(raw_results, query)
         
-        # キャッシュに保存
-        SEARCH_CACHE[cache_key] = (result, time.time())
+        # キャッシュに保存（結果0件はキャッシュしない）
+        if result['total_results'] > 0:
+            store_cached_result(cache_key, result)
         
         return result
         
-    except ImportError:
-        logger.error("Tavily module not found")
-        return create_fallback_response(params.get('query'))
     except Exception as e:
-        logger.error(f"Search error: {str(e)}")
-        return create_fallback_response(params.get('query'))
+        # パラメータ不正や整形エラーは API 障害ではないためキャッシュしない
+        logger.error("Search error: %s", e)
+        return create_fallback_response(query)
+
+
+def create_cached_fallback(cache_key: bytes, query: str) -> Dict[str, Any]:
+    """
+    フォールバックレスポンスを作成し、短いTTLでネガティブキャッシュする
+    （障害時に同じクエリでTavilyを呼び続けないようにする）
+    """
+    fallback = create_fallback_response(query)
+    store_cached_result(cache_key, fallback, NEGATIVE_CACHE_TTL)
+    return fallback
 
 
 def format_enhanced_search_results(raw_results: Dict[str, Any], query: str) -> Dict[str, Any]:
     """
     強化版：Tavily検索結果を整形（AI要約を含む）
     """
-    sources = []
-    urls = []
-    
-    for idx, result in enumerate(raw_results.get('results', [])):
-        url = result.get('url', '')
-        title = result.get('title', '')
-        content = result.get('content', '')
-        
-        # コンテンツを適切な長さに調整
-        if len(content) > 400:
-            content = content[:397] + "..."
-        
-        source_item = {
-            "id": f"source_{idx + 1}",
-            "url": url,
-            "title": title,
-            "snippet": content,
-            "relevance_score": result.get('score', 0.5),
-            # 追加情報
-            "published_date": result.get('published_date'),
-            "author": result.get('author')
-        }
-        
-        # None値を除去
-        source_item = {k: v for k, v in source_item.items() if v is not None}
-        
-        sources.append(source_item)
-        if url:
-            urls.append(url)
-    
-    # AI要約（Tavilyのinclude_answerによる）
-    summary = raw_results.get('answer', '')
+    response = format_results(raw_results, snippet_limit=400, include_metadata=True)
     
     # 画像情報（もし含まれていれば）
     images = raw_results.get('images', [])
-    
-    response = {
-        "summary": summary,
-        "sources": sources,
-        "urls": urls,
-        "total_results": len(sources)
-    }
-    
-    # 画像がある場合は追加
     if images:
         response["images"] = images[:5]  # 最大5枚
     
     return response
-
-
-def create_fallback_response(query: str) -> Dict[str, Any]:
-    """
-    エラー時のフォールバックレスポンス
-    """
-    return {
-        "summary": "検索結果を取得できませんでした。",
-        "sources": [],
-        "urls": [],
-        "total_results": 0
-    }
-
-
-def create_response(event: Dict[str, Any], body: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    API Gateway用のレスポンスを作成
-    """
-    response = {
-        "messageVersion": "1.0",
-        "response": {
-            "actionGroup": event.get("actionGroup", "WebSearchGroup"),
-            "function": event.get("function", "tavily_search"),
-            "functionResponse": {
-                "responseBody": {
-                    "TEXT": {
-                        "body": json.dumps(body, ensure_ascii=False)
-                    }
-                }
-            }
-        }
-    }
-    
-    return response
-
-
-def create_error_response(event: Dict[str, Any], error_message: str) -> Dict[str, Any]:
-    """
-    エラーレスポンスを作成
-    """
-    params = extract_all_parameters(event)
-    error_body = {
-        "type": "search_results",
-        "query": params.get('query', ''),
-        "search_performed": False,
-        "error": error_message,
-        "summary": f"エラーが発生しました: {error_message}",
-        "sources": [],
-        "urls": [],
-        "total_results": 0
-    }
-    
-    return create_response(event, error_body)
\ No newline at end of file
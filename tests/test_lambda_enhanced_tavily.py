@@ -0,0 +1,143 @@
+"""
+lambda_enhanced_tavily のキャッシュ・single-flight の並行動作テスト
+実行: python -m unittest discover -s tests
+"""
+import threading
+import time
+import unittest
+
+import _tavily_common
+import lambda_enhanced_tavily as enhanced
+
+
+class FakeTavilyClient:
+    """
+    client.search の呼び出し回数を数えるテスト用クライアント
+    """
+    calls = 0
+    delay = 0.2
+    results = []
+    error = None
+
+    def __init__(self, api_key):
+        pass
+
+    def search(self, **search_params):
+        type(self).calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"answer": "", "results": list(self.results)}
+
+
+class FakeClientTestCase(unittest.TestCase):
+    """
+    TavilyClient をテスト用クライアントに差し替え、キャッシュを初期化する
+    """
+
+    def setUp(self):
+        self._saved_client = _tavily_common.TavilyClient
+        _tavily_common.TavilyClient = FakeTavilyClient
+        _tavily_common._TAVILY_CLIENT = None
+        FakeTavilyClient.calls = 0
+        FakeTavilyClient.results = []
+        FakeTavilyClient.error = None
+        enhanced.SEARCH_CACHE.clear()
+        enhanced._INFLIGHT.clear()
+
+    def tearDown(self):
+        _tavily_common.TavilyClient = self._saved_client
+        _tavily_common._TAVILY_CLIENT = None
+        enhanced.SEARCH_CACHE.clear()
+        enhanced._INFLIGHT.clear()
+
+    def _run_threads(self, target, count):
+        errors = []
+
+        def wrapper(*args):
+            try:
+                target(*args)
+            except Exception as e:  # スレッド内の例外を記録してテストで検出する
+                errors.append(e)
+
+        threads = [threading.Thread(target=wrapper, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+
+class EnhancedCacheConcurrencyTest(FakeClientTestCase):
+
+    def test_concurrent_cache_reads_and_writes(self):
+        keys = [bytes([i]) for i in range(64)]
+        deadline = time.time() + 1.0
+
+        def worker(index):
+            while time.time() < deadline:
+                for key in keys:
+                    if index % 2:
+                        enhanced.store_cached_result(key, {"total_results": 1})
+                    else:
+                        enhanced.get_cached_result(key)
+
+        saved_max = enhanced.CACHE_MAX_ENTRIES
+        enhanced.CACHE_MAX_ENTRIES = 16
+        try:
+            errors = self._run_threads(worker, 5)
+        finally:
+            enhanced.CACHE_MAX_ENTRIES = saved_max
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(enhanced.SEARCH_CACHE), 16)
+
+    def test_zero_result_search_is_called_once(self):
+        results = []
+        errors = self._run_threads(
+            lambda _: results.append(
+                enhanced.perform_enhanced_tavily_search("key", {"query": "nothing"})),
+            5)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(FakeTavilyClient.calls, 1)
+        self.assertEqual([r["total_results"] for r in results], [0] * 5)
+        self.assertEqual(enhanced._INFLIGHT, {})
+
+    def test_cached_search_is_called_once(self):
+        FakeTavilyClient.results = [{"url": "https://example.com", "content": "x"}]
+        errors = self._run_threads(
+            lambda _: enhanced.perform_enhanced_tavily_search("key", {"query": "hit"}), 5)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(FakeTavilyClient.calls, 1)
+        self.assertIsNotNone(enhanced.get_cached_result(
+            enhanced.build_cache_key(enhanced.canonicalize_cache_params({"query": "hit"}))))
+
+
+class EnhancedNegativeCacheTest(FakeClientTestCase):
+
+    def test_api_error_is_negative_cached(self):
+        FakeTavilyClient.delay = 0
+        FakeTavilyClient.error = RuntimeError("api down")
+        try:
+            for _ in range(3):
+                result = enhanced.perform_enhanced_tavily_search("key", {"query": "down"})
+        finally:
+            FakeTavilyClient.delay = 0.2
+
+        self.assertEqual(result["total_results"], 0)
+        self.assertTrue(result.get("from_cache"))
+        self.assertEqual(FakeTavilyClient.calls, 1)
+
+    def test_parameter_error_is_not_negative_cached(self):
+        params = {"query": "bad", "max_results": "many"}
+        result = enhanced.perform_enhanced_tavily_search("key", params)
+
+        self.assertEqual(result["total_results"], 0)
+        self.assertEqual(FakeTavilyClient.calls, 0)
+        self.assertEqual(len(enhanced.SEARCH_CACHE), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()